@@ -10,7 +10,7 @@ import plotly.graph_objects as go
 import numpy as np
 import datetime as dt
 import math
-from stravaapi import constants, db_handler
+from stravaapi import constants, db_handler, mmp
 
 api = responder.API()
 
@@ -31,7 +31,10 @@ db = db_handler.Ath_DB()
 
 def adf_factor(x):
     """return an adjustment factor based on an fitted curve to the 
-    strava gradient adjusted pace curve"""
+    strava gradient adjusted pace curve
+
+    cached mean maximal curves depend on this, so bump
+    constants.GAP_VERSION when the coefficients change"""
     coeff = [0.0017002, 0.02949656] 
     return coeff[0]*x**2 + coeff[1]*x + 1.0
 
@@ -98,15 +101,19 @@ def refresh_token(ref_token):
     #resp.text = r.text
     return r.json()
 
-#get altitude stream
+#get altitude, distance and time streams
 # http get "https://www.strava.com/api/v3/activities/{id}/streams?keys=&key_by_type=
 def getaltitude(id):
+    """Get the altitude stream for an activity, along with the distance
+    and time streams needed for the mean maximal curve"""
     #get token
     auth_resp, valid_token = gettoken()
+    if not valid_token:
+        auth_resp = refresh_token(auth_resp['refresh_token'])
 
     act_url = f"https://www.strava.com/api/v3/activities/{id}/streams"
     headers={'Authorization': f"Bearer {auth_resp['access_token']}"}
-    params = {"keys":"altitude",
+    params = {"keys":"altitude,distance,time",
               "key_by_type":True} 
 
     r = requests.get(act_url,
@@ -122,11 +129,11 @@ def calc_altdiff(resp, st_ind, end_ind):
     assert resp['altitude'] is not None, "altitude data not in json response"
     return resp['altitude']['data'][end_ind] - resp['altitude']['data'][st_ind] 
 
-def calctrimp(lap, altr):
+def calctrimp(lap, altr, fts=constants.FTS):
     """calculates the training impulse for a lap
     TSS = (t * NGS * IF) / (FTS * 36)
         = t * IF**2 / 36
-    
+
     IF = intensity factor NGS / FTS
     NGS = normalised grade adjusted speed (km/hr)
     t = activity time in seconds
@@ -134,6 +141,7 @@ def calctrimp(lap, altr):
 
     input is a lap dictionary
     altr = altitude stream for the activity
+    fts = functional threshold speed (km/hr) at the time of the activity
 
     returns a tuple of the form
     (TRIMP, alt_diff, calc_grad, pace, NGP, NGS, IF)
@@ -144,7 +152,7 @@ def calctrimp(lap, altr):
     logger.debug(f"alt_diff = {alt_diff}")
     calc_grad = alt_diff / lap['distance'] * 100
     logger.debug(f"calc_grad = {calc_grad}")
-    
+
     #calculate speed
     speed = lap['distance'] / lap['moving_time'] * 3.6
     logger.debug(f"speed = {speed}")
@@ -162,7 +170,7 @@ def calctrimp(lap, altr):
     logger.debug(f"NGP = {format_pace(NGP)}")
 
     #calculate IF
-    IF = NGS / constants.FTS
+    IF = NGS / fts
     logger.debug(f"IF={IF}")
 
     #calulate TRIMP
@@ -189,7 +197,7 @@ def get_activities_detail(req, resp):
         
         #before calling the api check to see the data isn't already 
         #downloaded
-        res = db.conn.execute("select id from act_elevation where id=?",
+        res = db.conn.execute("select elev_stream from act_elevation where id=?",
                                 (row['id'],))
         res2 = db.conn.execute("select id from act_lap where id=?",
                                 (row['id'],))
@@ -200,6 +208,17 @@ def get_activities_detail(req, resp):
             elev_st, laps = getactivitydetail(row['id'])
             save_altr_to_db(row['id'], elev_st)
             save_laps_to_db(row['id'], laps)
+        elif (resrow[0] is not None and
+              (streams := json.loads(resrow[0])) is not None and
+              'time' not in streams):
+            #streams saved before distance and time were requested,
+            #download them again so the activity gets a curve. Strava
+            #always returns time when asked, so this only runs once even
+            #for activities without altitude or distance
+            logger.debug(f"Backfilling streams for activity: {row['id']}")
+            save_altr_to_db(row['id'], getaltitude(row['id']))
+            db.conn.execute("delete from act_mmp where id=?", (row['id'],))
+            db.conn.commit()
         #below for stopping at one activity for debugging.
         #return
 
@@ -213,6 +232,8 @@ def calc_trimps(req, resp):
                                 parse_dates={'start_date_local': {'utc':None}})
                       
     #logger.debug(act_df)
+    act_df = act_df.sort_values('start_date_local').reset_index(drop=True)
+    fts_list = calc_fts(act_df)
     trimps = []
     for index, row in act_df.iterrows():
         #get lap data
@@ -222,6 +243,7 @@ def calc_trimps(req, resp):
         #check for a NULL return from the database
         if (altr := json.loads(altr.fetchone()[0])) is None:
             logger.debug(f"Altitude data missing for act:{row['id']}")
+            trimps.append(0.0)
             continue
 
         #logger.debug(altr)
@@ -231,20 +253,72 @@ def calc_trimps(req, resp):
         #check for a NULL return from the database   
         if (json_act := json.loads(json_act.fetchone()[0])) is None:
             logger.debug(f"lap detail data missing for act:{row['id']}")
+            trimps.append(0.0)
             continue               
             
         #logger.debug(json_act)
-        activity_sum = [calctrimp(lap,altr) for lap in json_act]
+        activity_sum = [calctrimp(lap,altr,fts_list[index])
+                        for lap in json_act]
         activity_trimp = sum([item[0] for item in activity_sum])
         logger.debug(activity_trimp)
         trimps.append(activity_trimp)
         #add trimp score backinto df
     act_df['TRIMP'] = trimps
-    
+
     calc_trimp_graph(act_df)
     logger.debug(act_df)
     #return act_df
 
+def get_activity_curve(id):
+    """Returns the mean maximal GAP curve for an activity, calculating it
+    from the saved streams and caching it in the database the first time.
+    Cached curves calculated with different settings are recalculated.
+    Returns None if the streams needed are not available."""
+    key = mmp.curve_key()
+    res = db.conn.execute("select curve from act_mmp where id=?", (id,))
+    if (resrow := res.fetchone()) is not None:
+        cached = json.loads(resrow[0])
+        if isinstance(cached, dict) and cached.get('key') == key:
+            return np.array(cached['curve'], dtype=float)
+        logger.debug(f"Cached curve for act:{id} is stale, recalculating")
+
+    res = db.conn.execute("select elev_stream from act_elevation where id=?",
+                            (id,))
+    #check for a missing row or a NULL stream column
+    if (resrow := res.fetchone()) is None or resrow[0] is None:
+        return None
+    curve = mmp.activity_curve(json.loads(resrow[0]), adf_factor)
+    if curve is not None:
+        save_curve_to_db(id, curve, key)
+    return curve
+
+def calc_fts(df):
+    """Fits the FTS (km/hr) for each activity in the df from the rolling
+    mean maximal envelope of the activities before it, so a race doesn't
+    raise the FTS it is scored against.
+    The df must be sorted by start_date_local. Until there are enough
+    efforts to fit, or when the fit isn't plausible, the previous FTS
+    (starting from constants.FTS) is used."""
+    curves = [get_activity_curve(id) for id in df['id']]
+    have = [i for i, curve in enumerate(curves) if curve is not None]
+    fts_list = []
+    dates = df['start_date_local'].values[have]
+    envelopes = mmp.rolling_envelopes(dates, [curves[i] for i in have])
+    efforts = mmp.window_efforts(dates)
+    last_fts = constants.FTS
+    env_i = 0
+    for i in range(len(df)):
+        fts_list.append(last_fts)
+        logger.debug(f"FTS for act {df.loc[i]['id']} = {last_fts}")
+        #refit including this activity, for use by the ones after it
+        if env_i < len(have) and have[env_i] == i:
+            if (efforts[env_i] >= constants.CS_MIN_EFFORTS and
+                    (fts := mmp.fit_fts(envelopes[env_i],
+                                        reference=last_fts)) is not None):
+                last_fts = fts
+            env_i += 1
+    return fts_list
+
 def calc_trimp_graph(df):
     """Calculates the trimp graph showing the three key metrics of training:
     -fitness
@@ -270,7 +344,7 @@ def calc_trimp_graph(df):
         fit.append(fit[-1] * np.exp(-1/constants.ALPHA_CTL) + row['trimps'])
         fat.append(fat[-1] * np.exp(-1/constants.ALPHA_ATL) + row['trimps'])
         form.append(constants.K1 * fit[-1] - constants.K2 * fat[-1])
-    
+
     trimp_days['fit'] = fit[1:]
     trimp_days['fat'] = fat[1:]
     trimp_days['form'] = form[1:]
@@ -329,7 +403,7 @@ def calc_trimp_days(df):
         logger.debug(df[fil_date])
         datesf.append(prev_day)
         trimps.append(df[fil_date]['TRIMP'].sum())
-    
+
     #logger.debug(tdct)
     df_new = pd.DataFrame({'date':datesf,'trimps':trimps})
     logger.debug(df_new)
@@ -338,9 +412,9 @@ def calc_trimp_days(df):
         
 
 
-    
 
-    
+
+
 
 def getactivitydetail(id):
     """Get a user activity by ID"""
@@ -458,7 +532,7 @@ def getactivities(req, resp):
     activities['dist_cum'] = (activities['distance'] / 1000) .cumsum()
     #calculate dist per day
     km_per_day = 2020 / 366
-    
+
     #today
     today = dt.datetime.now()
     dates = pd.date_range("2020-01-01",
@@ -466,7 +540,7 @@ def getactivities(req, resp):
                         ).tolist()
 
     list_2020 = list(np.arange(km_per_day,len(dates)*km_per_day,km_per_day))
-    
+
     fig = go.Figure(data=[
                     go.Scatter(name="Distance Ran",
                                  x=activities['start_date_local'],
@@ -499,7 +573,7 @@ def save_act_to_db(activities):
                         row['moving_time']
                         ))
                     
-    
+
     logger.debug(db_data)
     #commit to DB
     db.conn.executemany('INSERT OR IGNORE INTO activities VALUES \
@@ -512,7 +586,7 @@ def save_altr_to_db(id, altr):
     db_data = [id, json.dumps(altr)]                 
     logger.debug(db_data)
     #commit to DB
-    db.conn.execute('INSERT OR IGNORE INTO act_elevation VALUES \
+    db.conn.execute('INSERT OR REPLACE INTO act_elevation VALUES \
                         (?,?)',
                          db_data)
     db.conn.commit()
@@ -525,4 +599,17 @@ def save_laps_to_db(id, laps):
     db.conn.execute('INSERT OR IGNORE INTO act_lap VALUES \
                         (?,?)',
                          db_data)
+    db.conn.commit()
+
+def save_curve_to_db(id, curve, key):
+
+    #NaN is not valid json so durations past the activity end are nulls
+    #the key records the settings the curve was calculated with
+    db_data = [id, json.dumps({'key': key,
+                    'curve': [None if np.isnan(x) else x for x in curve]})]
+    logger.debug(db_data)
+    #commit to DB
+    db.conn.execute('INSERT OR REPLACE INTO act_mmp VALUES \
+                        (?,?)',
+                         db_data)
     db.conn.commit()
\ No newline at end of file
@@ -24,3 +24,16 @@ ALPHA_ATL = 15
 K1 = 1 #training load weight used for form calculation
 K2 = 2 #fatigue weight used for form calculation
 FUT_DAYS = 30 #number of days to predict into the future
+
+#Constants for the mean-maximal speed curve and FTS estimation
+FTS_WINDOW_DAYS = 90 #rolling window of activities used to fit FTS
+CS_MIN_DURATION = 180 #shortest effort (s) used in the critical speed fit
+CS_MAX_DURATION = 1200 #longest effort (s) used in the critical speed fit
+CS_FIT_POINTS = 20 #log spaced durations the critical speed is fitted at
+CS_MIN_D_PRIME = 50 #smallest D' (m) accepted from the critical speed fit
+CS_MAX_D_PRIME = 400 #largest D' (m) accepted from the critical speed fit
+CS_MAX_CHANGE = 0.15 #largest fractional change from the previous FTS
+CS_MIN_EFFORTS = 3 #activities needed in the window to fit FTS
+GAP_SMOOTHING = 15 #half width (s) of the window used to calculate gradient
+MAX_GRADIENT = 35 #clip gradients (%) to the range of the GAP table
+GAP_VERSION = 1 #bump when the GAP model in api.adf_factor changes
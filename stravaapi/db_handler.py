@@ -41,6 +41,13 @@ class Ath_DB:
         if self.conn.execute(query).fetchone() is None:
             logger.debug("Activity trimp table not found in DB, creating it.")
             self.create_act_trimp_table()
+
+        #check for the act_mmp table  
+        query = ("SELECT name from sqlite_master"
+                " WHERE type='table' AND name='act_mmp';")
+        if self.conn.execute(query).fetchone() is None:
+            logger.debug("Activity mean maximal table not found in DB, creating it.")
+            self.create_act_mmp_table()
     
     def create_act_table(self):
         query = ('''CREATE TABLE activities'''+
@@ -71,3 +78,9 @@ class Ath_DB:
         self.conn.execute(query)
         self.conn.commit()
 
+    def create_act_mmp_table(self):
+        query = ('''CREATE TABLE act_mmp'''+
+                " (id integer primary key, curve text);")
+        logger.debug(query)
+        self.conn.execute(query)
+        self.conn.commit()
@@ -0,0 +1,179 @@
+"""
+Mean-maximal (critical speed) curve calculations.
+
+Builds the best average grade adjusted speed for a set of durations from
+the distance, time and altitude streams of an activity, merges the
+per-activity curves into rolling envelopes and fits the functional
+threshold speed (FTS) from those envelopes.
+"""
+import hashlib
+import json
+import numpy as np
+from stravaapi import constants
+
+
+def default_durations(longest=6*60*60):
+    """returns the durations (s) the curve is evaluated at.
+    Every second up to 10 min, then log spaced out to longest."""
+    dense = np.arange(1, 601)
+    sparse = np.geomspace(601, longest, 120).round().astype(int)
+    return np.unique(np.concatenate([dense, sparse]))
+
+DURATIONS = default_durations()
+
+def curve_key(durations=DURATIONS):
+    """returns a key identifying the settings a curve was calculated with,
+    cached curves with a different key must be recalculated"""
+    settings = [[int(w) for w in durations],
+                constants.GAP_SMOOTHING,
+                constants.MAX_GRADIENT,
+                constants.GAP_VERSION]
+    return hashlib.sha1(json.dumps(settings).encode()).hexdigest()
+
+def has_streams(streams):
+    """checks the streams needed for the curve were downloaded"""
+    return streams is not None and all(streams.get(key) is not None
+                                for key in ('time', 'distance', 'altitude'))
+
+def gap_distance(streams, adjust):
+    """resamples an activity onto a 1 Hz grid and returns the cumulative
+    grade adjusted distance (m) at each second.
+
+    streams = strava streams keyed by type, must contain time, distance
+              and altitude
+    adjust = function returning the GAP adjustment factor for a gradient
+    """
+    time = np.asarray(streams['time']['data'], dtype=float)
+    dist = np.asarray(streams['distance']['data'], dtype=float)
+    alt = np.asarray(streams['altitude']['data'], dtype=float)
+
+    #resample to 1 Hz so that windows are a fixed number of samples wide
+    grid = np.arange(time[0], time[-1] + 1)
+    dist = np.interp(grid, time, dist)
+    alt = np.interp(grid, time, alt)
+
+    #gradient over a centred window, single samples are too noisy
+    k = constants.GAP_SMOOTHING
+    ahead = np.minimum(np.arange(len(grid)) + k, len(grid) - 1)
+    behind = np.maximum(np.arange(len(grid)) - k, 0)
+    run = dist[ahead] - dist[behind]
+    rise = alt[ahead] - alt[behind]
+    grad = np.divide(rise * 100, run, out=np.zeros_like(run), where=run > 0)
+    grad = np.clip(grad, -constants.MAX_GRADIENT, constants.MAX_GRADIENT)
+
+    step = np.diff(dist, prepend=dist[0]) * adjust(grad)
+    return np.cumsum(step)
+
+def mean_max_curve(cum_dist, durations=DURATIONS):
+    """returns the best average speed (km/hr) for each duration.
+
+    Each duration is a single O(n) pass over the difference of the
+    cumulative distance, rather than scanning every window sum.
+    Durations longer than the activity are NaN.
+    """
+    curve = np.full(len(durations), np.nan)
+    for i, w in enumerate(durations):
+        if w >= len(cum_dist):
+            break
+        best = np.max(cum_dist[w:] - cum_dist[:-w])
+        curve[i] = best / w * 3.6
+    return curve
+
+def activity_curve(streams, adjust, durations=DURATIONS):
+    """mean maximal GAP curve for an activity, or None if the streams
+    needed are missing or too short"""
+    if not has_streams(streams) or len(streams['time']['data']) < 2:
+        return None
+    return mean_max_curve(gap_distance(streams, adjust), durations)
+
+def merge_curves(envelope, curve):
+    """merges an activity curve into an envelope, keeping the best speed
+    for each duration"""
+    if envelope is None:
+        return curve.copy()
+    return np.fmax(envelope, curve)
+
+def rolling_envelopes(dates, curves, window_days=constants.FTS_WINDOW_DAYS):
+    """returns the mean maximal envelope of the previous window_days for
+    each activity.
+
+    dates = activity dates sorted ascending
+    curves = list of activity curves in the same order as dates
+
+    The window is kept as a two stack queue so each curve is merged a
+    constant number of times, no matter how many activities are in the
+    window.
+    """
+    dates = np.asarray(dates, dtype='datetime64[s]')
+    window = np.timedelta64(window_days, 'D')
+    #front holds (date, envelope of this curve and all newer in front)
+    front = []
+    back = []
+    back_env = None
+    envelopes = []
+    for date, curve in zip(dates, curves):
+        back.append((date, curve))
+        back_env = merge_curves(back_env, curve)
+
+        #drop activities that have fallen out of the window
+        while True:
+            if not front:
+                env = None
+                for old_date, old_curve in reversed(back):
+                    env = merge_curves(env, old_curve)
+                    front.append((old_date, env))
+                back = []
+                back_env = None
+            if front[-1][0] > date - window:
+                break
+            front.pop()
+
+        envelope = front[-1][1]
+        if back_env is not None:
+            envelope = np.fmax(envelope, back_env)
+        envelopes.append(envelope)
+    return envelopes
+
+def window_efforts(dates, window_days=constants.FTS_WINDOW_DAYS):
+    """returns the number of activities in the window_days up to and
+    including each activity, dates must be sorted ascending"""
+    dates = np.asarray(dates, dtype='datetime64[s]')
+    window = np.timedelta64(window_days, 'D')
+    first = np.searchsorted(dates, dates - window, side='right')
+    return np.arange(1, len(dates) + 1) - first
+
+def fit_fts(envelope, durations=DURATIONS,
+            min_duration=constants.CS_MIN_DURATION,
+            max_duration=constants.CS_MAX_DURATION,
+            points=constants.CS_FIT_POINTS, reference=None):
+    """fits the critical speed model distance = CS * t + D' to the
+    envelope between min_duration and max_duration.
+
+    The envelope is sampled at log spaced durations so the dense part of
+    the duration grid doesn't outweigh the longer efforts.
+
+    A fit is only accepted if D' is in a physiological range and, when a
+    reference FTS (km/hr) is given, the critical speed is within
+    CS_MAX_CHANGE of it. Easy runs with a fast finish otherwise give a
+    plausible looking fit at easy pace.
+
+    returns the critical speed in km/hr, used as the FTS, or None if the
+    envelope doesn't cover the whole range or the fit isn't plausible.
+    """
+    durations = np.asarray(durations)
+    #grid points bracketing the fit range
+    lo = np.searchsorted(durations, min_duration, side='right') - 1
+    hi = np.searchsorted(durations, max_duration)
+    if lo < 0 or hi >= len(durations) or np.isnan(envelope[lo:hi+1]).any():
+        return None
+    t = np.geomspace(min_duration, max_duration, points)
+    dist = np.interp(t, durations[lo:hi+1], envelope[lo:hi+1]) / 3.6 * t
+    cs, d_prime = np.polyfit(t, dist, 1)
+    #a flat envelope has no anaerobic reserve, so none of it was maximal
+    if (cs <= 0 or d_prime < constants.CS_MIN_D_PRIME or
+            d_prime > constants.CS_MAX_D_PRIME):
+        return None
+    if (reference is not None and
+            abs(cs * 3.6 - reference) > constants.CS_MAX_CHANGE * reference):
+        return None
+    return cs * 3.6
@@ -0,0 +1,130 @@
+import pytest
+import numpy as np
+from stravaapi import constants, mmp
+
+def flat(grad):
+    """GAP adjustment that leaves the speed unchanged"""
+    return np.ones_like(grad)
+
+def run_streams(speeds):
+    """1 Hz flat streams for a run at the given speeds (m/s)"""
+    time = list(range(len(speeds) + 1))
+    dist = [0.0] + list(np.cumsum(speeds))
+    return {"time":{"data":time},
+            "distance":{"data":dist},
+            "altitude":{"data":[10.0]*len(time)}}
+
+def test_mean_max_curve():
+    #5 min at 3 m/s with a 1 min surge at 5 m/s in the middle
+    speed = np.array([3.0]*120 + [5.0]*60 + [3.0]*120)
+    cum_dist = np.concatenate([[0], np.cumsum(speed)])
+    curve = mmp.mean_max_curve(cum_dist, [1, 60, 120, 300, 400])
+    assert pytest.approx(curve[0]) == 5.0 * 3.6
+    assert pytest.approx(curve[1]) == 5.0 * 3.6
+    assert pytest.approx(curve[2]) == (5.0*60 + 3.0*60) / 120 * 3.6
+    assert pytest.approx(curve[3]) == (3.0*240 + 5.0*60) / 300 * 3.6
+    assert np.isnan(curve[4])
+
+def test_activity_curve_flat():
+    #flat 10 min run at 4 m/s sampled every 2s, GAP makes no adjustment
+    time = list(range(0, 601, 2))
+    streams = {"time":{"data":time},
+               "distance":{"data":[4.0*t for t in time]},
+               "altitude":{"data":[10.0]*len(time)}}
+    curve = mmp.activity_curve(streams, flat, [1, 60, 600])
+    assert curve == pytest.approx([4.0*3.6]*3)
+    assert mmp.activity_curve({"altitude":{"data":[0,0]}},
+                              flat) is None
+
+def test_rolling_envelopes():
+    dates = np.array(['2020-01-01', '2020-02-01', '2020-04-15'],
+                     dtype='datetime64[s]')
+    curves = [np.array([10.0, 9.0]),
+              np.array([11.0, np.nan]),
+              np.array([8.0, 7.0])]
+    envs = mmp.rolling_envelopes(dates, curves, window_days=90)
+    assert list(envs[0]) == [10.0, 9.0]
+    assert list(envs[1]) == [11.0, 9.0]
+    #first activity has dropped out of the window
+    assert list(envs[2]) == [11.0, 7.0]
+
+def test_fit_fts():
+    #envelope generated from a critical speed model with D' of 200m
+    durations = np.arange(1, 3601)
+    cs = 4.0
+    envelope = (cs * durations + 200) / durations * 3.6
+    assert mmp.fit_fts(envelope, durations) == pytest.approx(cs * 3.6,
+                                                             rel=1e-3)
+    assert mmp.fit_fts(np.full(len(durations), np.nan), durations) is None
+
+def test_fit_fts_weights_long_efforts():
+    #on the default grid the 10-20 min efforts must count as much as the
+    #3-10 min ones, so a slower CS beyond 10 min pulls the fit down to
+    #the fit of log spaced points
+    durations = mmp.DURATIONS.astype(float)
+    dist = np.where(durations <= 600, 4.0*durations + 200,
+                                      3.5*durations + 500)
+    t = np.geomspace(180, 1200, 20)
+    expected = np.polyfit(t, np.where(t <= 600, 4.0*t + 200, 3.5*t + 500),
+                          1)[0] * 3.6
+    fts = mmp.fit_fts(dist / durations * 3.6)
+    assert fts == pytest.approx(expected, rel=1e-3)
+    assert fts < 13.5
+
+def test_fit_fts_short_runs():
+    #runs that don't reach CS_MAX_DURATION can't be fitted
+    stop = run_streams([4.0]*181 + [0.0])
+    jog = run_streams([2.0]*200)
+    for streams in (stop, jog):
+        assert mmp.fit_fts(mmp.activity_curve(streams, flat)) is None
+
+def test_fit_fts_not_maximal():
+    #a history of steady easy runs has no D' so isn't a maximal effort
+    curve = mmp.activity_curve(run_streams([10/3.6]*3600), flat)
+    assert mmp.fit_fts(curve) is None
+    #speed rising with duration gives a negative D'
+    envelope = np.linspace(10.0, 12.0, len(mmp.DURATIONS))
+    assert mmp.fit_fts(envelope) is None
+
+def test_activity_curve_short_streams():
+    empty = {"time":{"data":[]},
+             "distance":{"data":[]},
+             "altitude":{"data":[]}}
+    assert mmp.activity_curve(empty, flat) is None
+    single = {"time":{"data":[0]},
+              "distance":{"data":[0.0]},
+              "altitude":{"data":[10.0]}}
+    assert mmp.activity_curve(single, flat) is None
+
+def test_window_efforts():
+    dates = np.array(['2020-01-01', '2020-02-01', '2020-03-01',
+                      '2020-04-15'], dtype='datetime64[s]')
+    assert list(mmp.window_efforts(dates, window_days=90)) == [1, 2, 3, 3]
+
+def test_curve_key():
+    assert mmp.curve_key() == mmp.curve_key(mmp.DURATIONS)
+    assert mmp.curve_key() != mmp.curve_key(mmp.DURATIONS[:-1])
+
+def test_fit_fts_easy_run_with_surge():
+    #60 min easy run with a 3 min fast finish gives a D' in range, but
+    #the fit is easy pace so it is rejected against the current FTS
+    curve = mmp.activity_curve(run_streams([2.7]*3420 + [3.3]*180), flat)
+    assert mmp.fit_fts(curve) == pytest.approx(2.7 * 3.6, rel=1e-3)
+    assert mmp.fit_fts(curve, reference=constants.FTS) is None
+
+def test_fit_fts_d_prime_range():
+    durations = np.arange(1, 3601)
+    for d_prime in (20, 600):
+        envelope = (4.0 * durations + d_prime) / durations * 3.6
+        assert mmp.fit_fts(envelope, durations) is None
+
+def test_fit_fts_reference():
+    durations = np.arange(1, 3601)
+    envelope = (4.0 * durations + 200) / durations * 3.6
+    assert mmp.fit_fts(envelope, durations, reference=15.0) is not None
+    assert mmp.fit_fts(envelope, durations, reference=18.0) is None
+
+def test_curve_key_gap_version(monkeypatch):
+    key = mmp.curve_key()
+    monkeypatch.setattr(constants, "GAP_VERSION", constants.GAP_VERSION + 1)
+    assert mmp.curve_key() != key
@@ -1,5 +1,8 @@
 import pytest
-from stravaapi import api
+import sqlite3
+import types
+import pandas as pd
+from stravaapi import api, constants, db_handler, mmp
 
 def test_trimp():
 
@@ -38,3 +41,101 @@ def test_trimp_1():
 
 def test_adf_factor():
     assert api.adf_factor(20) == pytest.approx(2.2700112)  
+
+def test_trimp_fts():
+    #running at twice the FTS for an hour is IF 2
+    lap = {'start_index':0,
+           'end_index':1,
+           'moving_time':60*60, #1hr
+            'distance':15.0*1000}
+    alt = {"altitude":{"data":[0,0]}}
+    TRIMP, alt_diff, calc_grad, pace, NGP, NGS, IF = api.calctrimp(lap,alt,
+                                                                  7.5)
+    assert pytest.approx(IF) == 2.0
+    assert pytest.approx(TRIMP) == 400.0
+
+def test_calc_trimps_alignment(monkeypatch):
+    #in memory DB with one activity missing detail, one with only the
+    #altitude stream and one with the full streams, saved out of order
+    conn = sqlite3.connect(":memory:")
+    fake_db = types.SimpleNamespace(conn=conn)
+    for create in (db_handler.Ath_DB.create_act_table,
+                   db_handler.Ath_DB.create_act_elev_table,
+                   db_handler.Ath_DB.create_act_lap_table,
+                   db_handler.Ath_DB.create_act_mmp_table):
+        create(fake_db)
+    monkeypatch.setattr(api, "db", fake_db)
+
+    lap = {'start_index':0,
+           'end_index':1,
+           'moving_time':60*60, #1hr at FTS
+           'distance':constants.FTS*1000}
+    time = list(range(601))
+    full = {"time":{"data":time},
+            "distance":{"data":[4.0*t for t in time]},
+            "altitude":{"data":[0.0]*len(time)}}
+    alt_only = {"altitude":{"data":[0.0, 0.0]}}
+    rows = [(3, "2020-01-03T07:00:00Z", full, [lap]),
+            (1, "2020-01-01T07:00:00Z", None, None),
+            (2, "2020-01-02T07:00:00Z", alt_only, [lap])]
+    for id, date, streams, laps in rows:
+        conn.execute("INSERT INTO activities VALUES (?,?,?,?,?)",
+                     (id, date, 1000.0, 3600, 3600))
+        api.save_altr_to_db(id, streams)
+        api.save_laps_to_db(id, laps)
+
+    graphs = []
+    monkeypatch.setattr(api, "calc_trimp_graph", graphs.append)
+    api.calc_trimps(None, None)
+
+    df = graphs[0]
+    assert list(df['id']) == [1, 2, 3]
+    assert list(df['TRIMP']) == pytest.approx([0.0, 100.0, 100.0])
+    #too few efforts to fit so every activity uses the default FTS
+    assert api.calc_fts(df) == [constants.FTS] * 3
+
+def test_calc_fts_excludes_own_activity(monkeypatch):
+    #three training runs then a race, the race's own curve must not
+    #raise the FTS it is scored against
+    def model_curve(cs):
+        return (cs * mmp.DURATIONS + 200) / mmp.DURATIONS * 3.6
+    curves = {1: model_curve(4.2), 2: model_curve(4.2),
+              3: model_curve(4.2), 4: model_curve(4.6)}
+    monkeypatch.setattr(api, "get_activity_curve", curves.get)
+    df = pd.DataFrame({'id': [1, 2, 3, 4],
+                       'start_date_local': pd.to_datetime(
+                           ["2020-01-01", "2020-01-02", "2020-01-03",
+                            "2020-01-04"], utc=True)})
+    fts_list = api.calc_fts(df)
+    assert fts_list[:3] == [constants.FTS] * 3
+    assert fts_list[3] == pytest.approx(4.2 * 3.6, rel=1e-3)
+
+def test_backfill_streams_once(monkeypatch):
+    #old altitude only streams are downloaded again, a treadmill run
+    #already saved with time but no altitude is left alone
+    conn = sqlite3.connect(":memory:")
+    fake_db = types.SimpleNamespace(conn=conn)
+    for create in (db_handler.Ath_DB.create_act_table,
+                   db_handler.Ath_DB.create_act_elev_table,
+                   db_handler.Ath_DB.create_act_lap_table,
+                   db_handler.Ath_DB.create_act_mmp_table):
+        create(fake_db)
+    monkeypatch.setattr(api, "db", fake_db)
+
+    old = {"altitude":{"data":[0.0, 0.0]}}
+    treadmill = {"time":{"data":[0, 1]}, "distance":{"data":[0.0, 3.0]}}
+    for id, streams in ((1, old), (2, treadmill)):
+        conn.execute("INSERT INTO activities VALUES (?,?,?,?,?)",
+                     (id, "2020-01-01T07:00:00Z", 1000.0, 3600, 3600))
+        api.save_altr_to_db(id, streams)
+        api.save_laps_to_db(id, [])
+
+    downloads = []
+    def getaltitude(id):
+        downloads.append(id)
+        return treadmill
+    monkeypatch.setattr(api, "getaltitude", getaltitude)
+    api.get_activities_detail(None, None)
+    api.get_activities_detail(None, None)
+
+    assert downloads == [1]